@@ -1,9 +1,15 @@
+import asyncio
 import logging
+import os
 import sys
 from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing
 from datetime import timedelta, date
 from traceback import format_exc
-from typing import Dict
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, TextIO, Tuple
 
 from jinja2 import Environment, FileSystemLoader
 from pydantic import ValidationError, Field
@@ -11,7 +17,6 @@ from pydantic_settings import BaseSettings
 
 from hubstaff import Hubstaff, DailyActivitiesResponse
 
-
 # set up logging configuration
 log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 file_handler = logging.FileHandler('hbs-report-generator.log')
@@ -30,52 +35,208 @@ class Settings(BaseSettings):
     api_email: str = Field(alias='HUBSTAFF_API_EMAIl')
     api_password: str = Field(alias='HUBSTAFF_API_PASSWORD')
     api_token: str = Field(alias='HUBSTAFF_API_APP_TOKEN')
+    cache_path: str = Field('hbs_cache.sqlite', alias='HUBSTAFF_CACHE_PATH')
 
     class Config:
         env_file = '.env'
 
 
-def accumulate_activities(activities: DailyActivitiesResponse) -> Dict[str, Dict[str, timedelta]]:
-    """Processes report data into a format suitable for the HTML template."""
+class ActivitiesTable(NamedTuple):
+    """Tracked seconds by project and user, only tracked cells are present."""
 
-    project_map = {project.id: project.name for project in activities.projects}
-    user_map = {user.id: user.name for user in activities.users}
-    # prepare activities cross table
-    daily_activity_summary = {
-        project: {user: timedelta(0) for user in sorted(user_map.values())}
-        for project in sorted(project_map.values())
-    }
-    # summarize activities
-    for activity in activities.daily_activities:
-        project_name = project_map[activity.project_id]
-        user_name = user_map[activity.user_id]
-        daily_activity_summary[project_name][user_name] += timedelta(seconds=activity.tracked)
+    users: List[str]
+    tracked: Dict[str, Dict[str, int]]
+
+
+class ActivitiesSummary:
+    """Running summary of tracked seconds by project and user."""
+
+    def __init__(self):
+        self.project_map: Dict[int, str] = {}
+        self.user_map: Dict[int, str] = {}
+        self.tracked_by_ids: Dict[Tuple[int, int], int] = defaultdict(int)
+
+    def add(self, activities: DailyActivitiesResponse) -> None:
+        """Adds a page of activities to the summary."""
+        self.project_map.update((project.id, project.name) for project in activities.projects)
+        self.user_map.update((user.id, user.name) for user in activities.users)
+        # summarize activities by project and user ids
+        for activity in activities.daily_activities:
+            self.tracked_by_ids[activity.project_id, activity.user_id] += activity.tracked
+
+    def cross_table(self) -> ActivitiesTable:
+        """Returns tracked seconds as a project by user cross table."""
+
+        # resolve names once per tracked cell, untracked cells are left out
+        tracked = {project: {} for project in sorted(self.project_map.values())}
+        for (project_id, user_id), seconds in self.tracked_by_ids.items():
+            cells = tracked[self.project_map[project_id]]
+            user = self.user_map[user_id]
+            cells[user] = cells.get(user, 0) + seconds
+
+        return ActivitiesTable(users=sorted(set(self.user_map.values())), tracked=tracked)
+
+    def merge(self, other: 'ActivitiesSummary') -> None:
+        """Adds another summary to this one."""
+        self.project_map.update(other.project_map)
+        self.user_map.update(other.user_map)
+        for ids, seconds in other.tracked_by_ids.items():
+            self.tracked_by_ids[ids] += seconds
+
+
+def accumulate_activities(activities: DailyActivitiesResponse) -> ActivitiesTable:
+    """
+    Processes report data into a format suitable for the HTML template.
+    Tracked time is summarized in seconds.
+    """
+    summary = ActivitiesSummary()
+    summary.add(activities)
+    return summary.cross_table()
+
+
+def summarize_page(payload: Dict[str, Any]) -> ActivitiesSummary:
+    """Validates a raw page of activities and summarizes it, runs in a worker process."""
+    summary = ActivitiesSummary()
+    summary.add(DailyActivitiesResponse.from_page(payload))
+    return summary
+
+
+class PagePool:
+    """
+    Process pool summarizing raw pages of activities.
+    Started on first use, it bounds the pages in flight to the number of workers.
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.slots = asyncio.Semaphore(self.max_workers)
+        self.executor: ProcessPoolExecutor | None = None
 
-    return daily_activity_summary
+    def __enter__(self) -> 'PagePool':
+        return self
 
+    def __exit__(self, *exc_info) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
 
-def render_html_template(tracked_activities: dict, report_date: date) -> str:
-    """Renders report from HTML template."""
-    env = Environment(loader=FileSystemLoader('templates'))
-    template = env.get_template('report.html')
+    async def submit(self, payload: Dict[str, Any]) -> 'asyncio.Future[ActivitiesSummary]':
+        """Waits for a free worker and submits the page, returns the future of its summary."""
+        await self.slots.acquire()
+        try:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.max_workers)
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, summarize_page, payload
+            )
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+
+async def accumulate_activities_parallel(
+    payloads: AsyncIterator[Dict[str, Any]], pool: PagePool
+) -> ActivitiesTable:
+    """
+    Processes raw report pages as they are fetched, merging page summaries
+    into the running totals as they complete.
+    Pages followed by more pages go to the pool, the last one is summarized in place,
+    so single page results never start it.
+    """
+    summary = ActivitiesSummary()
+    pending = set()
+    # closing the payloads cancels their prefetch as soon as we stop consuming
+    async with aclosing(payloads):
+        try:
+            async for payload in payloads:
+                if payload.get('pagination') is None:
+                    summary.add(DailyActivitiesResponse.from_page(payload))
+                else:
+                    pending.add(await pool.submit(payload))
+
+                for future in [future for future in pending if future.done()]:
+                    pending.discard(future)
+                    summary.merge(future.result())
+
+            for future in asyncio.as_completed(pending):
+                summary.merge(await future)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    return summary.cross_table()
+
+
+def to_timedelta(seconds: int) -> timedelta:
+    """Template filter converting seconds to timedelta."""
+    return timedelta(seconds=seconds)
+
+
+# compile report template once
+_ENV = Environment(
+    loader=FileSystemLoader(Path(__file__).parent / 'templates'),
+    autoescape=True,
+    auto_reload=False,
+)
+_ENV.filters['to_timedelta'] = to_timedelta
+_TEMPLATE = _ENV.get_template('report.html')
+
+
+def render_html_template(tracked_activities: dict, report_date: date, output: TextIO) -> None:
+    """Renders report from HTML template, streaming it to the output."""
     context = {'report_date': report_date, 'tracked_activities': tracked_activities}
-    return template.render(context)
+    _TEMPLATE.stream(context).dump(output)
 
 
-def produce_report(hubstaff_service: Hubstaff, date_start: date, date_end: date) -> str:
+async def produce_report(
+    hubstaff_service: Hubstaff, date_start: date, date_end: date, output: TextIO
+) -> None:
     """Collects data from Hubstaff Api and generates report based on HTML template."""
-    org_response = hubstaff_service.get_organizations()
-
-    tracked_activities = {}
-    for org in org_response.organizations:
-        operations = hubstaff_service.get_operations_by_day(
-            organization_id=org.id,
-            date_start=date_start,
-            date_stop=date_end,
-        )
-        tracked_activities[org.name] = accumulate_activities(operations)
+    org_response = await hubstaff_service.get_organizations()
+
+    # fetch activities of all organizations concurrently,
+    # validating and summarizing pages on all cores
+    with PagePool() as pool:
+        try:
+            # the first failure cancels the other organizations
+            async with asyncio.TaskGroup() as group:
+                tasks = [
+                    group.create_task(
+                        accumulate_activities_parallel(
+                            hubstaff_service.iter_operations_payloads(
+                                organization_id=org.id,
+                                date_start=date_start,
+                                date_stop=date_end,
+                            ),
+                            pool,
+                        )
+                    )
+                    for org in org_response.organizations
+                ]
+        except ExceptionGroup as error:
+            # surface the failure itself to the caller
+            raise error.exceptions[0]
+
+    tracked_activities = {
+        org.name: task.result() for org, task in zip(org_response.organizations, tasks)
+    }
+
+    render_html_template(tracked_activities, date_start, output)
+
 
-    return render_html_template(tracked_activities, date_start)
+async def generate_report(
+    settings: Settings, date_start: date, date_end: date, output: TextIO
+) -> None:
+    """Opens Hubstaff Api session and produces the report."""
+    async with Hubstaff(
+        settings.api_url,
+        settings.api_email,
+        settings.api_password,
+        settings.api_token,
+        cache_path=settings.cache_path,
+    ) as service:
+        await produce_report(service, date_start, date_end, output)
 
 
 def main() -> None:
@@ -98,11 +259,9 @@ def main() -> None:
 
     try:
         settings = Settings()
-        service = Hubstaff(
-            settings.api_url, settings.api_email, settings.api_password, settings.api_token
+        asyncio.run(
+            generate_report(settings, args.date_start, args.date_end or args.date_start, sys.stdout)
         )
-        html_report = produce_report(service, args.date_start, args.date_end or args.date_start)
-        sys.stdout.write(html_report)
         logger.info('Generated report for %s', args.date_start)
     except ValidationError:
         logger.error('Unable to parse data: %s', format_exc())
@@ -1,17 +1,27 @@
+import asyncio
+import hashlib
+import json
 import logging
-from datetime import date
-from typing import List, Dict, Optional, Set
-
+import sqlite3
+import time
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from itertools import chain
+from typing import Any, AsyncIterator, List, Dict, Optional, Set, Type
+
+import httpx
+import orjson
 import pydantic
-import requests
-from pydantic import BaseModel
-from requests_toolbelt import MultipartEncoder, sessions
+from pydantic import BaseModel, TypeAdapter
 from tenacity import (
+    RetryCallState,
     retry,
     stop_after_attempt,
-    wait_fixed,
+    wait_exponential_jitter,
+    retry_if_exception_type,
     retry_if_not_exception_type,
 )
+from tenacity.wait import wait_base
 
 logger = logging.getLogger(__name__)
 
@@ -49,24 +59,17 @@ class OrganizationsResponse(PageableResponse):
 
 
 class User(BaseModel, frozen=True):
-    """Model for user details."""
+    """Model for user details, other api fields are ignored."""
 
     id: int
     name: str
-    first_name: str
-    last_name: str
-    email: str
-    time_zone: str
-    status: str
 
 
 class Project(BaseModel, frozen=True):
-    """Model for project details."""
+    """Model for project details, other api fields are ignored."""
 
     id: int
     name: str
-    status: str
-    billable: bool
 
 
 class DailyActivity(BaseModel):
@@ -89,109 +92,334 @@ class DailyActivitiesResponse(PageableResponse):
     users: Set[User]
     projects: Set[Project]
 
+    @classmethod
+    def from_page(cls, payload: Dict[str, Any]) -> 'DailyActivitiesResponse':
+        """
+        Builds the response from a raw page payload.
+        Only the nested collections are validated, the envelope is trusted.
+        """
+        pagination = payload.get('pagination')
+        return cls.model_construct(
+            daily_activities=_DAILY_ACTIVITIES_ADAPTER.validate_python(payload['daily_activities']),
+            users=_USERS_ADAPTER.validate_python(payload['users']),
+            projects=_PROJECTS_ADAPTER.validate_python(payload['projects']),
+            pagination=None if pagination is None else PageableModel.model_validate(pagination),
+        )
+
+
+_DAILY_ACTIVITIES_ADAPTER = TypeAdapter(List[DailyActivity])
+_USERS_ADAPTER = TypeAdapter(Set[User])
+_PROJECTS_ADAPTER = TypeAdapter(Set[Project])
+
+# validators of api responses, built once at import time
+_VALIDATORS = {
+    cls: TypeAdapter(cls)
+    for cls in (AuthTokenResponse, OrganizationsResponse, DailyActivitiesResponse)
+}
+
+
+# Retry strategy
+class wait_retry_after(wait_base):
+    """
+    Waits as long as the Retry-After header of a rate limited response asks,
+    falls back to another wait strategy otherwise.
+    """
+
+    def __init__(self, fallback: wait_base, max_wait: float = 60):
+        self.fallback = fallback
+        self.max_wait = max_wait
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception()
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+            if (retry_after := self.parse_retry_after(error.response)) is not None:
+                return min(retry_after, self.max_wait)
+        return self.fallback(retry_state)
+
+    @staticmethod
+    def parse_retry_after(response: httpx.Response) -> float | None:
+        """Parses Retry-After header given either in seconds or as HTTP date."""
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+# Response cache
+class ResponseCache:
+    """Persistent SQLite cache of raw api responses."""
+
+    DEFAULT_EXPIRE_AFTER = timedelta(days=7)
+
+    def __init__(self, path: str, scope: List[str], expire_after: timedelta = DEFAULT_EXPIRE_AFTER):
+        # responses are cached per api url and account
+        self.scope = scope
+        self.expire_after = expire_after
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, created REAL NOT NULL, content BLOB NOT NULL)'
+            )
+            # purge expired responses, so the file does not grow between runs
+            self.db.execute(
+                'DELETE FROM responses WHERE created < ?',
+                (time.time() - expire_after.total_seconds(),),
+            )
+
+    def make_key(
+        self,
+        method: str,
+        path: str,
+        params: Dict[str, str] | None,
+        headers: Dict[str, str] | None,
+    ) -> str:
+        """Builds cache key from the scope, request method, path, parameters and headers."""
+        request = json.dumps(
+            [self.scope, method.upper(), path, params, headers], sort_keys=True, default=str
+        )
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        """Returns cached response content unless it is missing or expired."""
+        row = self.db.execute(
+            'SELECT created, content FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or time.time() - row[0] > self.expire_after.total_seconds():
+            return None
+        return row[1]
+
+    def set(self, key: str, content: bytes) -> None:
+        """Stores response content."""
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', (key, time.time(), content)
+            )
+
+    def delete(self, key: str) -> None:
+        """Removes response content."""
+        with self.db:
+            self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def close(self) -> None:
+        self.db.close()
+
 
 # Api wrapper
 class Hubstaff:
     """Hubstaff api client."""
 
     DEFAULT_TIMEOUT = 10
+    MAX_CONNECTIONS = 32
+    MAX_KEEPALIVE_CONNECTIONS = 20
+    KEEPALIVE_TIMEOUT = 30
 
-    def __init__(self, base_url: str, email: str, password: str, app_token: str):
-        self.http = sessions.BaseUrlSession(base_url=base_url)
-        self.http.headers['Accept'] = 'application/json'
-        self.http.headers['AppToken'] = app_token
-        self.http.hooks['response'] = lambda response, *args, **kwargs: response.raise_for_status()
-
-        # authenticate and store the token
-        self.http.params = {'auth_token': self.authenticate(email, password).auth_token}
-
-    def authenticate(self, email: str, password: str) -> AuthTokenResponse:
+    def __init__(
+        self,
+        base_url: str,
+        email: str,
+        password: str,
+        app_token: str,
+        cache_path: str | None = None,
+    ):
+        self.base_url = base_url
+        self.app_token = app_token
+        self.cache_path = cache_path
+        self.http: httpx.AsyncClient | None = None
+        self.cache: ResponseCache | None = None
+        self.__credentials = (email, password)
+
+    async def __aenter__(self) -> 'Hubstaff':
+        if self.cache_path is not None:
+            self.cache = ResponseCache(
+                self.cache_path, scope=[self.base_url, self.__credentials[0]]
+            )
+        # HTTP/2 multiplexes concurrent requests over a single connection
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.MAX_CONNECTIONS,
+                max_keepalive_connections=self.MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=self.KEEPALIVE_TIMEOUT,
+            ),
+            headers={'Accept': 'application/json', 'AppToken': self.app_token},
+            timeout=self.DEFAULT_TIMEOUT,
+            follow_redirects=True,
+        )
+        try:
+            # authenticate and store the token
+            auth = await self.authenticate(*self.__credentials)
+            self.http.params = {'auth_token': auth.auth_token}
+        except BaseException:
+            await self.__aexit__()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.http.aclose()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def authenticate(self, email: str, password: str) -> AuthTokenResponse:
         """Authenticates user and return the authentication token."""
 
         api_path = '/v454/account/signin'
-        payload = MultipartEncoder({'email': email, 'password': password})
-        response = self.__send_request(
+        payload = {'email': email, 'password': password}
+        response = await self.__send_request(
             method='post',
             path=api_path,
             data=payload,
-            headers={'Content-Type': payload.content_type},
             response_type=AuthTokenResponse,
         )
         return response
 
-    def get_organizations(self) -> OrganizationsResponse:
+    async def get_organizations(self) -> OrganizationsResponse:
         """Retrieves organizations using the authentication token."""
 
         api_path = '/v454/institution'
-        result = OrganizationsResponse(organizations=[])
+        pages = []
         params = {}
 
         has_next_page = True
         while has_next_page:
-            response = self.__send_request(
+            response = await self.__send_request(
                 method='get', path=api_path, params=params, response_type=OrganizationsResponse
             )
 
-            result.organizations.extend(response.organizations)
+            pages.append(response.organizations)
 
             if has_next_page := response.pagination is not None:
                 params.update({'page_start_id': response.pagination.next_page_start_id})
 
-        return result
+        # join pages with a single copy
+        return OrganizationsResponse.model_construct(
+            organizations=list(chain.from_iterable(pages)), pagination=None
+        )
 
-    def get_operations_by_day(
+    async def iter_operations_payloads(
         self, organization_id: int, date_start: date, date_stop: date
-    ) -> DailyActivitiesResponse:
+    ) -> AsyncIterator[Dict[str, Any]]:
         """
         Fetches daily activities data for the specified date range and organization.
-        Handles pagination to fetch all pages of data.
+        Handles pagination and yields raw page payloads, left for the caller to validate.
+        Responses for past dates are cached, since they no longer change.
         """
         api_path = f'/v454/institution/{organization_id}/operations/by_day'
+        # headers are shared by all pages
+        headers = {'DateStart': date_start.isoformat(), 'DateStop': date_stop.isoformat()}
 
-        result = DailyActivitiesResponse(daily_activities=[], users=set(), projects=set())
         params = {'include': 'users,projects'}
+        cache = date_stop < date.today()
 
-        has_next_page = True
-        while has_next_page:
-            response = self.__send_request(
-                method='get',
-                path=api_path,
-                params=params,
-                headers={
-                    'DateStart': date_start.strftime('%Y-%m-%d'),
-                    'DateStop': date_stop.strftime('%Y-%m-%d'),
-                },
-                response_type=DailyActivitiesResponse,
+        next_page = asyncio.create_task(
+            self.__send_request(
+                method='get', path=api_path, params=params, headers=headers, cache=cache
             )
-            result.daily_activities.extend(response.daily_activities)
-            result.users.update(response.users)
-            result.projects.update(response.projects)
-
-            if has_next_page := response.pagination is not None:
-                params.update({'page_start_id': response.pagination.next_page_start_id})
-
-        return result
+        )
+        try:
+            while next_page is not None:
+                payload = await next_page
+
+                # request the next page before handing out the current one,
+                # so the transfer overlaps with its processing
+                next_page = None
+                if payload.get('pagination') is not None:
+                    pagination = PageableModel.model_validate(payload['pagination'])
+                    params = {**params, 'page_start_id': pagination.next_page_start_id}
+                    next_page = asyncio.create_task(
+                        self.__send_request(
+                            method='get',
+                            path=api_path,
+                            params=params,
+                            headers=headers,
+                            cache=cache,
+                        )
+                    )
+                    # let the prefetch task send its request
+                    await asyncio.sleep(0)
+
+                yield payload
+        finally:
+            if next_page is not None:
+                next_page.cancel()
 
     @retry(
-        retry=retry_if_not_exception_type(pydantic.ValidationError),
+        # cancellation is a BaseException and must not be retried
+        retry=retry_if_exception_type(Exception)
+        & retry_if_not_exception_type(pydantic.ValidationError),
         stop=stop_after_attempt(3),
-        wait=wait_fixed(1),
+        wait=wait_retry_after(wait_exponential_jitter(initial=0.5, max=8, jitter=0.5)),
         reraise=True,
     )
-    def __send_request(
+    async def __send_request(
         self,
         method: str,
         path: str,
         params: Dict[str, str] | None = None,
         headers: Dict[str, str] | None = None,
-        data: Dict[str, str] | MultipartEncoder | None = None,
-        response_type: BaseModel | None = None,
+        data: Dict[str, str] | None = None,
+        response_type: Type[BaseModel] | None = None,
         timeout: int = DEFAULT_TIMEOUT,
-    ) -> requests.Response | BaseModel:
-        """Makes an HTTP request with specified method, path, parameters and headers."""
+        cache: bool = False,
+    ) -> Any | BaseModel:
+        """
+        Makes an HTTP request with specified method, path, parameters and headers.
+        Cached content is returned for GET requests with cache enabled.
+        """
 
-        logger.info('%s path=%s params=%s headers=%s', method.upper(), path, params, headers)
-        response = self.http.request(
-            method=method, url=path, params=params, headers=headers, data=data, timeout=timeout
-        )
-        return response if response_type is None else response_type.model_validate(response.json())
+        content = cache_key = None
+        if cache and self.cache is not None and method.lower() == 'get':
+            cache_key = self.cache.make_key(method, path, params, headers)
+            content = self.cache.get(cache_key)
+        cached = content is not None
+
+        if not cached:
+            logger.info('%s path=%s params=%s headers=%s', method.upper(), path, params, headers)
+            response = await self.http.request(
+                method=method,
+                url=path,
+                params=params,
+                headers=headers,
+                data=data,
+                timeout=timeout,
+            )
+            if response.is_error:
+                logger.error(
+                    '%s path=%s status=%s response=%s',
+                    method.upper(),
+                    path,
+                    response.status_code,
+                    response.content,
+                )
+                response.raise_for_status()
+            content = response.content
+        else:
+            logger.info(
+                'CACHED %s path=%s params=%s headers=%s', method.upper(), path, params, headers
+            )
+
+        try:
+            if response_type is None:
+                result = orjson.loads(content)
+            elif (validator := _VALIDATORS.get(response_type)) is not None:
+                # parse and validate raw bytes in one pass
+                result = validator.validate_json(content)
+            else:
+                result = response_type.model_validate_json(content)
+        except ValueError:
+            # never serve a broken body again
+            if cached:
+                self.cache.delete(cache_key)
+            raise
+
+        # only bodies that decode are cached
+        if cache_key is not None and not cached:
+            self.cache.set(cache_key, content)
+        return result
@@ -1,12 +1,29 @@
-from datetime import date, timedelta
+import asyncio
+import io
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Dict, List
 
+import httpx
 import pytest
-import responses
+import pytest_asyncio
+import respx
+from pydantic import BaseModel, ValidationError
 
-from generator import accumulate_activities, produce_report
+from generator import (
+    ActivitiesTable,
+    PagePool,
+    accumulate_activities,
+    accumulate_activities_parallel,
+    produce_report,
+    render_html_template,
+)
 from hubstaff import (
     Hubstaff,
     DailyActivitiesResponse,
+    ResponseCache,
+    wait_retry_after,
 )
 
 BASE_URL = 'https://localhost'
@@ -45,45 +62,60 @@ API_DAILY_ACTIVITIES_RESPONSE = {
 
 
 @pytest.fixture
-def patch_base_url_session():
-    def all_matcher(request):
-        return True, ''
-
-    with responses.RequestsMock() as rsps:
-        rsps.add(
-            responses.POST,
-            f'{BASE_URL}/v454/account/signin',
-            json=API_TOKEN_RESPONSE,
-            status=200,
-            match=[all_matcher],
-        )
-        yield rsps
+def mocked_api():
+    with respx.mock(base_url=BASE_URL, assert_all_called=False) as mocked:
+        mocked.post(path='/v454/account/signin').respond(json=API_TOKEN_RESPONSE)
+        yield mocked
 
 
-@pytest.fixture
-def hubstaff_client(patch_base_url_session):
+@pytest_asyncio.fixture
+async def hubstaff_client(mocked_api):
     # initialize the Hubstaff client
-    client = Hubstaff(
+    async with Hubstaff(
         base_url=f'{BASE_URL}',
         email='test@example.com',
         password='password',
         app_token='app_token',
-    )
-    return client
+    ) as client:
+        yield client
+
+
+def get_requests(mocked_api) -> list:
+    """Lists urls of GET requests sent to the mocked api."""
+    return [str(request.url) for request, _ in mocked_api.calls if request.method == 'GET']
+
+
+@pytest.mark.asyncio
+async def test_authenticate(hubstaff_client, mocked_api):
+    request, _ = mocked_api.calls[0]
+    assert request.url == f'{BASE_URL}/v454/account/signin'
+    assert request.headers['Content-Type'] == 'application/x-www-form-urlencoded'
+    assert request.content == b'email=test%40example.com&password=password'
+    assert hubstaff_client.http.params['auth_token'] == 'sample_token'
+
 
+async def fetch_activities(
+    client: Hubstaff, date_start: date, date_stop: date
+) -> DailyActivitiesResponse:
+    """Collects validated activity pages of the first organization."""
+    result = DailyActivitiesResponse(daily_activities=[], users=set(), projects=set())
+    async for payload in client.iter_operations_payloads(
+        organization_id=1, date_start=date_start, date_stop=date_stop
+    ):
+        page = DailyActivitiesResponse.from_page(payload)
+        result.daily_activities.extend(page.daily_activities)
+        result.users.update(page.users)
+        result.projects.update(page.projects)
+    return result
 
-@responses.activate
-def test_get_organizations(hubstaff_client, patch_base_url_session):
+
+@pytest.mark.asyncio
+async def test_get_organizations(hubstaff_client, mocked_api):
     # set up the mocked response
-    responses.add(
-        responses.GET,
-        f'{BASE_URL}/v454/institution',
-        json=API_ORGANIZATIONS_RESPONSE,
-        status=200,
-    )
+    mocked_api.get(path='/v454/institution').respond(json=API_ORGANIZATIONS_RESPONSE)
 
     # call the get_organizations method
-    response = hubstaff_client.get_organizations()
+    response = await hubstaff_client.get_organizations()
 
     # assert the response
     assert len(response.organizations) == 2
@@ -92,31 +124,37 @@ def test_get_organizations(hubstaff_client, patch_base_url_session):
     assert response.organizations[1].id == 2
     assert response.organizations[1].name == 'Organization 2'
 
-    assert len(responses.calls) == 1
-    assert responses.calls[0].request.url == f'{BASE_URL}/v454/institution?auth_token=sample_token'
-    assert responses.calls[0].request.method == responses.GET
+    assert get_requests(mocked_api) == [f'{BASE_URL}/v454/institution?auth_token=sample_token']
+
+
+@pytest.mark.asyncio
+async def test_get_organizations_redirect(hubstaff_client, mocked_api):
+    mocked_api.get(path='/v454/institution').respond(
+        301, headers={'Location': f'{BASE_URL}/v455/institution'}
+    )
+    mocked_api.get(path='/v455/institution').respond(json=API_ORGANIZATIONS_RESPONSE)
+
+    response = await hubstaff_client.get_organizations()
 
+    assert [organization.id for organization in response.organizations] == [1, 2]
+    assert get_requests(mocked_api) == [
+        f'{BASE_URL}/v454/institution?auth_token=sample_token',
+        f'{BASE_URL}/v455/institution',
+    ]
 
-@responses.activate
-def test_get_operations_by_day(hubstaff_client, patch_base_url_session):
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads(hubstaff_client, mocked_api):
     # Set up the mocked response
-    responses.add(
-        responses.GET,
-        f'{BASE_URL}/v454/institution/1/operations/by_day',
-        json=API_DAILY_ACTIVITIES_RESPONSE,
-        status=200,
+    mocked_api.get(path='/v454/institution/1/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
     )
-    responses.add(
-        responses.GET,
-        f'{BASE_URL}/v454/institution/2/operations/by_day',
-        json=API_DAILY_ACTIVITIES_RESPONSE,
-        status=200,
+    mocked_api.get(path='/v454/institution/2/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
     )
 
-    # call the get_operations_by_day method
-    response = hubstaff_client.get_operations_by_day(
-        organization_id=1, date_start=date(2024, 9, 2), date_stop=date(2024, 9, 3)
-    )
+    # fetch activities of the organization
+    response = await fetch_activities(hubstaff_client, date(2024, 9, 2), date(2024, 9, 3))
 
     # assert the response
     assert len(response.daily_activities) == 1
@@ -133,47 +171,446 @@ def test_get_operations_by_day(hubstaff_client, patch_base_url_session):
     assert project.id == 1
     assert project.name == 'Project 1'
 
-    assert len(responses.calls) == 1
+    assert get_requests(mocked_api) == [
+        f'{BASE_URL}/v454/institution/1/operations/by_day'
+        '?auth_token=sample_token&include=users%2Cprojects'
+    ]
+
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads_pagination(hubstaff_client, mocked_api):
+    first_page = {**API_DAILY_ACTIVITIES_RESPONSE, 'pagination': {'next_page_start_id': 2}}
+    second_page = {
+        **API_DAILY_ACTIVITIES_RESPONSE,
+        'daily_activities': [{**API_DAILY_ACTIVITIES_RESPONSE['daily_activities'][0], 'id': 2}],
+    }
+    mocked_api.get(path='/v454/institution/1/operations/by_day').mock(
+        side_effect=[httpx.Response(200, json=first_page), httpx.Response(200, json=second_page)]
+    )
+
+    response = await fetch_activities(hubstaff_client, date(2024, 9, 2), date(2024, 9, 3))
+
+    assert [activity.id for activity in response.daily_activities] == [1, 2]
+    assert len(response.users) == 1
+    assert len(response.projects) == 1
+    assert get_requests(mocked_api) == [
+        f'{BASE_URL}/v454/institution/1/operations/by_day'
+        '?auth_token=sample_token&include=users%2Cprojects',
+        f'{BASE_URL}/v454/institution/1/operations/by_day'
+        '?auth_token=sample_token&include=users%2Cprojects&page_start_id=2',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads_prefetch(hubstaff_client, mocked_api):
+    first_page = {**API_DAILY_ACTIVITIES_RESPONSE, 'pagination': {'next_page_start_id': 2}}
+    mocked_api.get(path='/v454/institution/1/operations/by_day').mock(
+        side_effect=[
+            httpx.Response(200, json=first_page),
+            httpx.Response(200, json=API_DAILY_ACTIVITIES_RESPONSE),
+        ]
+    )
+    second_page_url = (
+        f'{BASE_URL}/v454/institution/1/operations/by_day'
+        '?auth_token=sample_token&include=users%2Cprojects&page_start_id=2'
+    )
+
+    pages = 0
+    async for payload in hubstaff_client.iter_operations_payloads(
+        organization_id=1, date_start=date(2024, 9, 2), date_stop=date(2024, 9, 3)
+    ):
+        pages += 1
+        if pages == 1:
+            # the next page is requested before the first one is handed out
+            assert payload['pagination'] == {'next_page_start_id': 2}
+            assert second_page_url in get_requests(mocked_api)
+    assert pages == 2
+
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads_cache(mocked_api, tmp_path):
+    route = mocked_api.get(path='/v454/institution/1/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
+    )
+
+    for _ in range(2):
+        async with Hubstaff(
+            base_url=f'{BASE_URL}',
+            email='test@example.com',
+            password='password',
+            app_token='app_token',
+            cache_path=str(tmp_path / 'cache.sqlite'),
+        ) as client:
+            response = await fetch_activities(client, date(2024, 9, 2), date(2024, 9, 3))
+            assert len(response.daily_activities) == 1
+
+    # the second run is served from the cache
+    assert route.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_organizations_rate_limited(hubstaff_client, mocked_api):
+    route = mocked_api.get(path='/v454/institution').mock(
+        side_effect=[
+            httpx.Response(429, headers={'Retry-After': '0'}),
+            httpx.Response(200, json=API_ORGANIZATIONS_RESPONSE),
+        ]
+    )
+
+    response = await hubstaff_client.get_organizations()
+
+    assert len(response.organizations) == 2
+    assert route.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_organizations_cancelled(hubstaff_client, mocked_api):
+    requests = []
+
+    async def stalled_page(request):
+        requests.append(request)
+        await asyncio.sleep(60)
+
+    mocked_api.get(path='/v454/institution').mock(side_effect=stalled_page)
+
+    task = asyncio.create_task(hubstaff_client.get_organizations())
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # a cancelled request is not sent again
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_send_request_unregistered_response_type(hubstaff_client, mocked_api):
+    class InstitutionIds(BaseModel):
+        organizations: List[Dict[str, int | str]]
+
+    route = mocked_api.get(path='/v454/institution').respond(json=API_ORGANIZATIONS_RESPONSE)
+
+    response = await hubstaff_client._Hubstaff__send_request(
+        method='get', path='/v454/institution', response_type=InstitutionIds
+    )
+
+    assert len(response.organizations) == 2
+    assert route.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads_cache_scope(mocked_api, tmp_path):
+    route = mocked_api.get(path='/v454/institution/1/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
+    )
+
+    for email in ('test@example.com', 'other@example.com'):
+        async with Hubstaff(
+            base_url=f'{BASE_URL}',
+            email=email,
+            password='password',
+            app_token='app_token',
+            cache_path=str(tmp_path / 'cache.sqlite'),
+        ) as client:
+            await fetch_activities(client, date(2024, 9, 2), date(2024, 9, 3))
+
+    # another account does not share cached responses
+    assert route.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads_cache_invalid_body(mocked_api, tmp_path):
+    route = mocked_api.get(path='/v454/institution/1/operations/by_day').mock(
+        side_effect=[
+            httpx.Response(200, content=b'{"daily_activities": ['),
+            httpx.Response(200, json=API_DAILY_ACTIVITIES_RESPONSE),
+        ]
+    )
+
+    async with Hubstaff(
+        base_url=f'{BASE_URL}',
+        email='test@example.com',
+        password='password',
+        app_token='app_token',
+        cache_path=str(tmp_path / 'cache.sqlite'),
+    ) as client:
+        # the truncated body is retried instead of being cached
+        response = await fetch_activities(client, date(2024, 9, 2), date(2024, 9, 3))
+        assert len(response.daily_activities) == 1
+        assert route.call_count == 2
+
+        response = await fetch_activities(client, date(2024, 9, 2), date(2024, 9, 3))
+        assert len(response.daily_activities) == 1
+        assert route.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads_cache_skips_today(mocked_api, tmp_path):
+    route = mocked_api.get(path='/v454/institution/1/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
+    )
+
+    for _ in range(2):
+        async with Hubstaff(
+            base_url=f'{BASE_URL}',
+            email='test@example.com',
+            password='password',
+            app_token='app_token',
+            cache_path=str(tmp_path / 'cache.sqlite'),
+        ) as client:
+            await fetch_activities(client, date.today(), date.today())
+
+    # today's data may still change
+    assert route.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_iter_operations_payloads_cache_expired(mocked_api, tmp_path):
+    route = mocked_api.get(path='/v454/institution/1/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
+    )
+    cache_path = tmp_path / 'cache.sqlite'
+
+    for _ in range(2):
+        async with Hubstaff(
+            base_url=f'{BASE_URL}',
+            email='test@example.com',
+            password='password',
+            app_token='app_token',
+            cache_path=str(cache_path),
+        ) as client:
+            await fetch_activities(client, date(2024, 9, 2), date(2024, 9, 3))
+
+        # age cached responses past expiration
+        with sqlite3.connect(cache_path) as db:
+            db.execute('UPDATE responses SET created = created - ?', (8 * 24 * 3600,))
+
+    assert route.call_count == 2
+    with sqlite3.connect(cache_path) as db:
+        assert db.execute('SELECT COUNT(*) FROM responses').fetchone() == (1,)
+
+    # expired responses are purged when the cache is opened
+    ResponseCache(str(cache_path), scope=[]).close()
+    with sqlite3.connect(cache_path) as db:
+        assert db.execute('SELECT COUNT(*) FROM responses').fetchone() == (0,)
+
+
+def test_parse_retry_after():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    response = httpx.Response(429, headers={'Retry-After': format_datetime(retry_at, usegmt=True)})
+    assert 28 <= wait_retry_after.parse_retry_after(response) <= 30
+
+    response = httpx.Response(429, headers={'Retry-After': '5'})
+    assert wait_retry_after.parse_retry_after(response) == 5
+
+    past = format_datetime(datetime.now(timezone.utc) - timedelta(minutes=1), usegmt=True)
     assert (
-        responses.calls[0].request.url
-        == f'{BASE_URL}/v454/institution/1/operations/by_day?auth_token=sample_token&include=users%2Cprojects'
+        wait_retry_after.parse_retry_after(httpx.Response(429, headers={'Retry-After': past})) == 0
     )
-    assert responses.calls[0].request.method == responses.GET
+
+    response = httpx.Response(429, headers={'Retry-After': 'soon'})
+    assert wait_retry_after.parse_retry_after(response) is None
+    assert wait_retry_after.parse_retry_after(httpx.Response(429)) is None
 
 
 def test_process_report_data():
     sample_data = DailyActivitiesResponse.model_validate(API_DAILY_ACTIVITIES_RESPONSE)
-    expected_report = {'Project 1': {'User 1': timedelta(seconds=3600)}}
+    expected_report = ActivitiesTable(users=['User 1'], tracked={'Project 1': {'User 1': 3600}})
     report = accumulate_activities(sample_data)
     assert report == expected_report
 
 
-@responses.activate
-def test_generate_report(hubstaff_client, patch_base_url_session):
-    responses.add(
-        responses.GET,
-        f'{BASE_URL}/v454/institution',
-        json=API_ORGANIZATIONS_RESPONSE,
-        status=200,
+def test_process_report_data_summary():
+    activity = API_DAILY_ACTIVITIES_RESPONSE['daily_activities'][0]
+    user = API_DAILY_ACTIVITIES_RESPONSE['users'][0]
+    project = API_DAILY_ACTIVITIES_RESPONSE['projects'][0]
+    sample_data = DailyActivitiesResponse.model_validate(
+        {
+            'daily_activities': [
+                activity,
+                {**activity, 'id': 2, 'tracked': 1800},
+                {**activity, 'id': 3, 'user_id': 2, 'project_id': 2, 'tracked': 600},
+            ],
+            'users': [user, {**user, 'id': 2, 'name': 'User 2'}],
+            'projects': [project, {**project, 'id': 2, 'name': 'Project 2'}],
+        }
     )
-    responses.add(
-        responses.GET,
-        f'{BASE_URL}/v454/institution/1/operations/by_day',
-        json=API_DAILY_ACTIVITIES_RESPONSE,
-        status=200,
+    expected_report = ActivitiesTable(
+        users=['User 1', 'User 2'],
+        tracked={'Project 1': {'User 1': 5400}, 'Project 2': {'User 2': 600}},
     )
-    responses.add(
-        responses.GET,
-        f'{BASE_URL}/v454/institution/2/operations/by_day',
-        json=API_DAILY_ACTIVITIES_RESPONSE,
-        status=200,
+    report = accumulate_activities(sample_data)
+    assert report == expected_report
+
+
+def test_process_report_data_order():
+    activity = API_DAILY_ACTIVITIES_RESPONSE['daily_activities'][0]
+    user = API_DAILY_ACTIVITIES_RESPONSE['users'][0]
+    project = API_DAILY_ACTIVITIES_RESPONSE['projects'][0]
+    sample_data = DailyActivitiesResponse.model_validate(
+        {
+            'daily_activities': [
+                {**activity, 'id': i, 'user_id': i, 'project_id': i} for i in range(1, 4)
+            ],
+            'users': [{**user, 'id': i, 'name': f'User {4 - i}'} for i in range(1, 4)],
+            'projects': [{**project, 'id': i, 'name': f'Project {4 - i}'} for i in range(1, 4)],
+        }
     )
+    report = accumulate_activities(sample_data)
+    assert report.users == ['User 1', 'User 2', 'User 3']
+    assert list(report.tracked) == ['Project 1', 'Project 2', 'Project 3']
+
+
+@pytest.mark.asyncio
+async def test_process_report_data_parallel():
+    user = API_DAILY_ACTIVITIES_RESPONSE['users'][0]
+    first_page = {**API_DAILY_ACTIVITIES_RESPONSE, 'pagination': {'next_page_start_id': 2}}
+    second_page = {
+        **API_DAILY_ACTIVITIES_RESPONSE,
+        'daily_activities': [
+            {**API_DAILY_ACTIVITIES_RESPONSE['daily_activities'][0], 'id': 2, 'user_id': 2}
+        ],
+        'users': [{**user, 'id': 2, 'name': 'User 2'}],
+    }
+
+    async def payloads():
+        yield first_page
+        yield second_page
 
-    html_output = produce_report(
-        hubstaff_client, date_start=date(2024, 9, 2), date_end=date(2024, 9, 3)
+    expected_report = ActivitiesTable(
+        users=['User 1', 'User 2'], tracked={'Project 1': {'User 1': 3600, 'User 2': 3600}}
     )
+    with PagePool(max_workers=1) as pool:
+        report = await accumulate_activities_parallel(payloads(), pool)
+        assert pool.executor is not None
+    assert report == expected_report
+
+
+@pytest.mark.asyncio
+async def test_process_report_data_parallel_bounded():
+    class CountingPool(PagePool):
+        in_flight = max_in_flight = 0
+
+        async def submit(self, payload):
+            future = await super().submit(payload)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            future.add_done_callback(lambda _: setattr(self, 'in_flight', self.in_flight - 1))
+            return future
+
+    page = {**API_DAILY_ACTIVITIES_RESPONSE, 'pagination': {'next_page_start_id': 2}}
+
+    async def payloads():
+        for _ in range(10):
+            yield page
+        yield API_DAILY_ACTIVITIES_RESPONSE
+
+    with CountingPool(max_workers=2) as pool:
+        report = await accumulate_activities_parallel(payloads(), pool)
+    assert report.tracked == {'Project 1': {'User 1': 11 * 3600}}
+    assert 1 <= pool.max_in_flight <= 2
+
+
+@pytest.mark.asyncio
+async def test_process_report_data_parallel_single_page():
+    async def payloads():
+        yield API_DAILY_ACTIVITIES_RESPONSE
+
+    expected_report = ActivitiesTable(users=['User 1'], tracked={'Project 1': {'User 1': 3600}})
+    with PagePool() as pool:
+        report = await accumulate_activities_parallel(payloads(), pool)
+        # a single page is summarized in place
+        assert pool.executor is None
+    assert report == expected_report
+
+
+@pytest.mark.asyncio
+async def test_process_report_data_parallel_closes_payloads():
+    class ClosedPool(PagePool):
+        async def submit(self, payload):
+            raise RuntimeError('cannot schedule new futures after shutdown')
+
+    closed = False
+
+    async def payloads():
+        nonlocal closed
+        try:
+            yield {**API_DAILY_ACTIVITIES_RESPONSE, 'pagination': {'next_page_start_id': 2}}
+            yield API_DAILY_ACTIVITIES_RESPONSE
+        finally:
+            closed = True
+
+    with ClosedPool() as pool:
+        with pytest.raises(RuntimeError):
+            await accumulate_activities_parallel(payloads(), pool)
+    # the payloads are closed as soon as the consumer fails
+    assert closed
+
+
+def test_render_html_template_escapes_names():
+    tracked_activities = {
+        'Acme <Labs>': ActivitiesTable(users=['O\'Brien'], tracked={'R&D': {'O\'Brien': 60}})
+    }
+    output = io.StringIO()
+    render_html_template(tracked_activities, date(2024, 9, 2), output)
+    html_output = output.getvalue()
+
+    assert 'Acme &lt;Labs&gt;' in html_output
+    assert '<td>R&amp;D</td>' in html_output
+    assert '<th>O&#39;Brien</th>' in html_output
+    assert 'R&D' not in html_output
+    assert '0:01:00' in html_output
+
+
+@pytest.mark.asyncio
+async def test_generate_report(hubstaff_client, mocked_api):
+    mocked_api.get(path='/v454/institution').respond(json=API_ORGANIZATIONS_RESPONSE)
+    mocked_api.get(path='/v454/institution/1/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
+    )
+    mocked_api.get(path='/v454/institution/2/operations/by_day').respond(
+        json=API_DAILY_ACTIVITIES_RESPONSE
+    )
+
+    output = io.StringIO()
+    await produce_report(
+        hubstaff_client, date_start=date(2024, 9, 2), date_end=date(2024, 9, 3), output=output
+    )
+    html_output = output.getvalue()
     assert 'Organization 1' in html_output
     assert 'Organization 2' in html_output
     assert 'Project 1' in html_output
     assert 'User 1' in html_output
     assert '2024-09-02' in html_output
+    assert '1:00:00' in html_output
+
+
+@pytest.mark.asyncio
+async def test_produce_report_cancels_on_failure(hubstaff_client, mocked_api):
+    cancelled = asyncio.Event()
+    requests = []
+
+    async def stalled_page(request):
+        requests.append(request)
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    invalid_activity = {**API_DAILY_ACTIVITIES_RESPONSE['daily_activities'][0], 'tracked': 'n/a'}
+    mocked_api.get(path='/v454/institution').respond(json=API_ORGANIZATIONS_RESPONSE)
+    mocked_api.get(path='/v454/institution/1/operations/by_day').respond(
+        json={**API_DAILY_ACTIVITIES_RESPONSE, 'daily_activities': [invalid_activity]}
+    )
+    mocked_api.get(path='/v454/institution/2/operations/by_day').mock(side_effect=stalled_page)
+
+    # the failure of one organization is raised without waiting for the others
+    with pytest.raises(ValidationError):
+        await asyncio.wait_for(
+            produce_report(hubstaff_client, date(2024, 9, 2), date(2024, 9, 3), io.StringIO()),
+            timeout=5,
+        )
+    # the other organization is cancelled, not retried
+    assert cancelled.is_set()
+    assert len(requests) == 1